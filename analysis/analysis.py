@@ -6,6 +6,7 @@ from typing import List
 
 from tqdm import tqdm
 import settings
+from vcs import storage
 
 CHANGE_GRAPHS_STORAGE_DIR = settings.get("change_graphs_storage_dir")
 
@@ -36,14 +37,13 @@ def cgs_to_csv() -> None:
         csv_writer = csv.writer(fout, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL)
         csv_writer.writerow(["Repository name", "Commit date", "Number of nodes"])
         for file in tqdm([file for file in os.listdir(CHANGE_GRAPHS_STORAGE_DIR)
-                          if file.endswith(".pickle")]):
-            with open(os.path.join(CHANGE_GRAPHS_STORAGE_DIR, file), "rb") as fin:
-                graphs = pickle.load(fin)
-                for graph in graphs:
-                    cg = pickle.loads(graph)
-                    csv_writer.writerow([cg.repo_info.repo_name,
-                                         cg.repo_info.commit_dtm.strftime('%d.%m.%Y %H:%M:%S'),
-                                         len(cg.nodes)])
+                          if file.endswith((".pickle", ".pickle.zst")) and not file.startswith(".")]):
+            graphs = storage.load_pickled_graphs(os.path.join(CHANGE_GRAPHS_STORAGE_DIR, file))
+            for graph in graphs:
+                cg = pickle.loads(graph)
+                csv_writer.writerow([cg.repo_info.repo_name,
+                                     cg.repo_info.commit_dtm.strftime('%d.%m.%Y %H:%M:%S'),
+                                     len(cg.nodes)])
 
 
 def list_dirs(path: str) -> List[str]:
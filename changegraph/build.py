@@ -1,3 +1,5 @@
+import os
+import tempfile
 import time
 
 from log import logger
@@ -10,12 +12,29 @@ from changegraph import gumtree
 
 class ChangeGraphBuilder:  # TODO: make gumtree optional
     def build_from_files(self, path1, path2, repo_info=None):
+        with open(path1, 'r+') as f1, open(path2, 'r+') as f2:
+            src1, src2 = f1.read(), f2.read()
+        return self._build(src1, src2, path1, path2, repo_info=repo_info)
+
+    def build_from_sources(self, src1, src2, repo_info=None):
+        # GumTree is an external process and reads the sources from disk
+        with tempfile.NamedTemporaryFile(mode='w+t', suffix='.py') as t1, \
+                tempfile.NamedTemporaryFile(mode='w+t', suffix='.py') as t2:
+            t1.write(src1)
+            t1.flush()
+            t2.write(src2)
+            t2.flush()
+
+            return self._build(src1, src2, os.path.realpath(t1.name), os.path.realpath(t2.name),
+                               repo_info=repo_info)
+
+    def _build(self, src1, src2, path1, path2, repo_info=None):
         logger.warning(f'Change graph building...', show_pid=True)
         start_building = time.time()
 
         start = time.time()
-        fg1 = pyflowgraph.build_from_file(path1)
-        fg2 = pyflowgraph.build_from_file(path2)
+        fg1 = pyflowgraph.build_from_source(src1)
+        fg2 = pyflowgraph.build_from_source(src2)
         logger.warning('Flow graphs... OK', start_time=start, show_pid=True)
 
         start = time.time()
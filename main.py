@@ -11,6 +11,7 @@ from log import logger
 from patterns import Miner
 from patterns.models import Fragment, Pattern
 from vcs.traverse import GitAnalyzer, RepoInfo, Method
+from vcs import storage
 
 import pyflowgraph
 import changegraph
@@ -108,7 +109,7 @@ def main():
             miner.print_patterns()
         else:
             storage_dir = settings.get('change_graphs_storage_dir')
-            file_names = os.listdir(storage_dir)
+            file_names = [file_name for file_name in os.listdir(storage_dir) if not file_name.startswith('.')]
 
             logger.warning(f'Found {len(file_names)} files in storage directory')
 
@@ -116,9 +117,7 @@ def main():
             for file_num, file_name in enumerate(file_names):
                 file_path = os.path.join(storage_dir, file_name)
                 try:
-                    with open(file_path, 'rb') as f:
-                        graphs = pickle.load(f)
-
+                    graphs = storage.load_pickled_graphs(file_path)
                     for graph in graphs:
                         change_graphs.append(pickle.loads(graph))
                 except:
@@ -412,6 +412,19 @@ def test_complex_example10():
     }
 
 
+def test_build_from_sources():
+    src = utils.format_src("""
+        a = 10
+        b = a + 1
+    """)
+    dest = utils.format_src("""
+        a = 12
+        b = a + 1
+    """)
+    cg = changegraph.build_from_sources(src, dest)
+    assert _get_label_to_node_cnt(cg) == _get_label_to_node_cnt(_try_build_change_graph(src, dest))
+
+
 if __name__ == '__main__':
     test_complex_example10()
     test_complex_example9()
@@ -429,3 +442,5 @@ if __name__ == '__main__':
     test_var_attr_assign()
     test_var_rename1()
     test_for_statement1()
+
+    test_build_from_sources()
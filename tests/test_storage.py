@@ -0,0 +1,49 @@
+import pickle
+
+from vcs import storage
+
+
+def _get_pickled_graphs():
+    return [pickle.dumps({'graph': i, 'nodes': list(range(i))}, protocol=5) for i in range(10)]
+
+
+def test_compressed_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPRESSION_LEVEL', 3)
+    pickled_graphs = _get_pickled_graphs()
+    file_path = tmp_path / f'graphs{storage.get_file_extension()}'
+
+    storage.dump_pickled_graphs(iter(pickled_graphs), file_path)
+
+    with open(file_path, 'rb') as f:
+        assert f.read(4) == b'\x28\xb5\x2f\xfd'
+    assert list(storage.load_pickled_graphs(file_path)) == pickled_graphs
+
+
+def test_plain_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPRESSION_LEVEL', 0)
+    pickled_graphs = _get_pickled_graphs()
+    file_path = tmp_path / f'graphs{storage.get_file_extension()}'
+
+    storage.dump_pickled_graphs(iter(pickled_graphs), file_path)
+
+    with open(file_path, 'rb') as f:
+        assert pickle.load(f) == pickled_graphs[0]
+    assert list(storage.load_pickled_graphs(file_path)) == pickled_graphs
+
+
+def test_load_legacy_list(tmp_path):
+    pickled_graphs = _get_pickled_graphs()
+    file_path = tmp_path / 'graphs.pickle'
+    with open(file_path, 'wb') as f:
+        pickle.dump(pickled_graphs, f)
+
+    assert list(storage.load_pickled_graphs(file_path)) == pickled_graphs
+
+
+def test_load_empty_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPRESSION_LEVEL', 3)
+    file_path = tmp_path / 'graphs.pickle.zst'
+
+    storage.dump_pickled_graphs(iter([]), file_path)
+
+    assert list(storage.load_pickled_graphs(file_path)) == []
@@ -0,0 +1,117 @@
+import ast
+import subprocess
+
+from vcs.traverse import GitAnalyzer, extract_methods
+
+
+def _assert_sources_match(src):
+    methods = extract_methods('test.py', src, ast.parse(src, mode='exec'))
+    assert methods
+    for method in methods:
+        assert method.get_source() == ast.get_source_segment(src, method.ast)
+
+
+def test_source_after_non_ascii():
+    _assert_sources_match(
+        '# Ünïcödé comment\n'
+        's = "日本語"; t = "ü"\n'
+        'def f(a="é"):\n'
+        '    return "ß" + a\n'
+        'class A:\n'
+        '    def g(self): return "日本"\n'
+        '    def h(self):\n'
+        '        return "ö"  # ä\n')
+
+
+def test_source_with_crlf_line_endings():
+    _assert_sources_match(
+        'x = 1\r\n'
+        'def f():\r\n'
+        '    return "é"\r\n'
+        '\r\n'
+        'class A:\r\n'
+        '    def g(self):\r\n'
+        '        y = 2\r\n'
+        '        return y\r\n')
+
+
+def test_source_with_cr_line_endings():
+    _assert_sources_match(
+        'x = "ü"\r'
+        'def f():\r'
+        '    return 1\r'
+        'class A:\r'
+        '    def g(self):\r'
+        '        return "日本"\r')
+
+
+def _git(cwd, *args):
+    result = subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                            stdout=subprocess.PIPE, cwd=cwd, check=True)
+    return result.stdout.decode('utf-8').strip()
+
+
+def _add_config_lines(config_path, lines):
+    with open(config_path, 'a') as f:
+        f.writelines(f'{line}\n' for line in lines)
+
+
+def _assert_repo_url(repo_path, expected_url):
+    assert _git(repo_path, 'config', '--get', 'remote.origin.url') == expected_url
+    assert GitAnalyzer._get_repo_url(str(repo_path)) == expected_url
+
+
+def test_repo_url(tmp_path):
+    _git(tmp_path, 'init', '-q', 'repo')
+    _add_config_lines(tmp_path / 'repo' / '.git' / 'config', [
+        '[remote "origin"]',
+        '\turl = https://example.com/a.git'])
+
+    _assert_repo_url(tmp_path / 'repo', 'https://example.com/a.git')
+
+
+def test_repo_url_with_quotes_and_comments(tmp_path):
+    _git(tmp_path, 'init', '-q', 'repo')
+    _add_config_lines(tmp_path / 'repo' / '.git' / 'config', [
+        '[remote "origin"]',
+        '\turl = "https://example.com/a;b#c.git" ; comment'])
+
+    _assert_repo_url(tmp_path / 'repo', 'https://example.com/a;b#c.git')
+
+
+def test_repo_url_with_escapes(tmp_path):
+    _git(tmp_path, 'init', '-q', 'repo')
+    _add_config_lines(tmp_path / 'repo' / '.git' / 'config', [
+        '[remote "origin"]',
+        '\turl = https://example.com/a\\\\b.git # comment'])
+
+    _assert_repo_url(tmp_path / 'repo', 'https://example.com/a\\b.git')
+
+
+def test_repo_url_with_valueless_key(tmp_path):
+    _git(tmp_path, 'init', '-q', 'repo')
+    _add_config_lines(tmp_path / 'repo' / '.git' / 'config', [
+        '[remote "origin"]',
+        '\turl = https://example.com/a.git',
+        '[custom]',
+        '\tflag'])
+
+    _assert_repo_url(tmp_path / 'repo', 'https://example.com/a.git')
+
+
+def test_repo_url_of_worktree(tmp_path):
+    _git(tmp_path, 'init', '-q', 'repo')
+    _git(tmp_path / 'repo', 'commit', '-q', '--allow-empty', '-m', 'init')
+    _git(tmp_path / 'repo', 'remote', 'add', 'origin', 'https://example.com/a.git')
+    _git(tmp_path / 'repo', 'worktree', 'add', '-q', str(tmp_path / 'worktree'))
+
+    assert (tmp_path / 'worktree' / '.git').is_file()
+    _assert_repo_url(tmp_path / 'worktree', 'https://example.com/a.git')
+
+
+def test_repo_url_of_bare_repository(tmp_path):
+    _git(tmp_path, 'init', '-q', '--bare', 'repo')
+    _git(tmp_path / 'repo', 'remote', 'add', 'origin', 'https://example.com/a.git')
+
+    assert GitAnalyzer._is_repository(str(tmp_path / 'repo'))
+    _assert_repo_url(tmp_path / 'repo', 'https://example.com/a.git')
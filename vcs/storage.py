@@ -0,0 +1,105 @@
+import pickle
+import sqlite3
+
+import zstandard
+
+import settings
+
+
+COMPRESSION_LEVEL = settings.get('change_graphs_compression_level', 3)
+
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+_compressor = None
+
+
+def get_file_extension():
+    return '.pickle.zst' if COMPRESSION_LEVEL else '.pickle'
+
+
+def _get_compressor():
+    global _compressor
+    if _compressor is None:  # created lazily, once per worker process
+        _compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    return _compressor
+
+
+def _dump_each(pickled_graphs, f):
+    # graphs are dumped one by one, so only a single pickled graph is held in memory at a time
+    for pickled in pickled_graphs:
+        pickle.dump(pickled, f, protocol=5)
+
+
+def dump_pickled_graphs(pickled_graphs, file_path):
+    with open(file_path, 'w+b') as f:
+        if not COMPRESSION_LEVEL:
+            _dump_each(pickled_graphs, f)
+            return
+
+        with _get_compressor().stream_writer(f) as z:
+            _dump_each(pickled_graphs, z)
+
+
+def _load_each(f):
+    while True:
+        try:
+            loaded = pickle.load(f)
+        except EOFError:
+            return
+
+        if isinstance(loaded, list):  # files stored as a single list of pickled graphs
+            yield from loaded
+        else:
+            yield loaded
+
+
+def load_pickled_graphs(file_path):
+    with open(file_path, 'rb') as f:
+        is_compressed = f.read(len(_ZSTD_MAGIC)) == _ZSTD_MAGIC
+        f.seek(0)
+
+        if not is_compressed:
+            yield from _load_each(f)
+            return
+
+        with zstandard.ZstdDecompressor().stream_reader(f) as z:
+            yield from _load_each(z)
+
+
+class ProcessedCommits:
+    FLUSH_INTERVAL = 100
+
+    def __init__(self, db_path):
+        self._connection = sqlite3.connect(db_path, timeout=60)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS processed_commits '
+                                 '(repo TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (repo, hash))')
+        self._connection.commit()
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_hashes(self, repo_name):
+        rows = self._connection.execute('SELECT hash FROM processed_commits WHERE repo=?', (repo_name,))
+        return {row[0] for row in rows}
+
+    def add(self, repo_name, commit_hash):
+        self._pending.append((repo_name, commit_hash))
+        if len(self._pending) >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO processed_commits (repo, hash) VALUES (?, ?)', self._pending)
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
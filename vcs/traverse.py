@@ -1,17 +1,23 @@
 import os
-import tempfile
 import ast
-import uuid
 import pickle
 import multiprocessing
+import functools
+import itertools
 import time
 import json
+import queue
+import threading
 import subprocess
 import datetime
+import configparser
+import collections
+import re
 
 from log import logger
-from pydriller import RepositoryMining
-from pydriller.domain.commit import ModificationType
+import pygit2
+
+from vcs import storage
 
 import settings
 import changegraph
@@ -21,7 +27,27 @@ class GitAnalyzer:
     GIT_REPOSITORIES_DIR = settings.get('git_repositories_dir')
     STORAGE_DIR = settings.get('change_graphs_storage_dir')
     STORE_INTERVAL = settings.get('change_graphs_store_interval', 300)
+    PROCESSED_COMMITS_DB_PATH = os.path.join(STORAGE_DIR, '.processed_commits.db')
     TRAVERSE_ASYNC = settings.get('traverse_async', True)
+    PROCESSES = settings.get('traverse_processes', multiprocessing.cpu_count())
+    MAX_TASKS_PER_CHILD = settings.get('traverse_max_tasks_per_child', 1000)
+    EXTRACT_PROCESSES = settings.get('traverse_extract_processes', max(1, multiprocessing.cpu_count() // 4))
+    POOL_CHUNK_SIZE = settings.get('traverse_pool_chunk_size', 4)
+    MAX_TASK_MODIFICATIONS = settings.get('traverse_max_task_modifications', 50)
+    METHODS_CACHE_SIZE = settings.get('traverse_methods_cache_size', 32)
+
+    EXTRACT_QUEUE_TIMEOUT = 60
+    PENDING_GRAPHS_PREFIX = '.pending_'
+    REPOSITORIES_CACHE_SIZE = 4
+
+    _methods_cache = collections.OrderedDict()
+    _repositories = collections.OrderedDict()
+    _store_counter = itertools.count()
+
+    class ExtractionMessage:
+        STARTED = 'started'
+        COMMIT = 'commit'
+        DONE = 'done'
 
     MIN_DATE = None
     if settings.get('traverse_min_date', required=False):
@@ -53,57 +79,209 @@ class GitAnalyzer:
             json.dump(self._data, f, indent=4)
 
     def build_change_graphs(self):
-        repo_names = [
-            name for name in os.listdir(self.GIT_REPOSITORIES_DIR)
-            if not name.startswith('_') and not name.startswith('.') and name not in self._data['visited']]
+        with os.scandir(self.GIT_REPOSITORIES_DIR) as entries:
+            repo_names = [
+                entry.name for entry in entries
+                if not entry.name.startswith('_') and not entry.name.startswith('.')
+                and entry.is_dir() and self._is_repository(entry.path)
+                and entry.name not in self._data['visited']]
 
         if not repo_names:
             logger.warning('No available repositories were found')
             return
 
         logger.warning(f'Found {len(repo_names)} repositories, starting a build process')
+        self._remove_pending_change_graphs()
 
-        if GitAnalyzer.TRAVERSE_ASYNC:
-            with multiprocessing.Pool(processes=multiprocessing.cpu_count(), maxtasksperchild=1000) as pool:
-                self._mine_changes(repo_names, pool=pool)
-        else:
-            self._mine_changes(repo_names)
+        with storage.ProcessedCommits(self.PROCESSED_COMMITS_DB_PATH) as processed_commits:
+            if GitAnalyzer.TRAVERSE_ASYNC:
+                with multiprocessing.Pool(processes=self.PROCESSES,
+                                          maxtasksperchild=self.MAX_TASKS_PER_CHILD) as pool:
+                    self._mine_changes(repo_names, processed_commits, pool=pool)
+            else:
+                self._mine_changes(repo_names, processed_commits)
+
+    @staticmethod
+    def _is_repository(path):
+        if os.path.exists(os.path.join(path, '.git')):
+            return True
+
+        # bare repository
+        return os.path.isfile(os.path.join(path, 'HEAD')) and os.path.isdir(os.path.join(path, 'objects'))
+
+    def _mine_changes(self, repo_names, processed_commits, pool=None):
+        if pool:
+            self._mine_changes_async(repo_names, processed_commits, pool)
+            return
 
-    def _mine_changes(self, repo_names, pool=None):
         for repo_num, repo_name in enumerate(repo_names):
             logger.warning(f'Looking at repo {repo_name} [{repo_num + 1}/{len(repo_names)}]')
 
-            self._data['visited'].append(repo_name)
-            self._save_data_file()
-
             start = time.time()
-            commits = self._extract_commits(repo_name)
-
-            if pool and len(commits) > 0:
-                try:
-                    pool.map(self._build_and_store_change_graphs, commits)
-                except:
-                    logger.error(f'Pool.map failed for repo {repo_name}', exc_info=True)
-            else:
-                for commit in commits:
-                    self._build_and_store_change_graphs(commit)
+            is_processed = True
+            for commit in self._extract_commits(repo_name):
+                filenames = self._try_build_and_store_change_graphs(commit)[-1]
+                if filenames is not None:
+                    self._publish_change_graphs(filenames)
+                    processed_commits.add(repo_name, commit['hash'])
+                else:
+                    is_processed = False
+
+            # a repository with failed commits is visited again, only those commits are processed then
+            if is_processed:
+                self._mark_visited([repo_name], processed_commits)
 
             logger.warning(f'Done building change graphs for repo={repo_name} [{repo_num + 1}/{len(repo_names)}]',
                            start_time=start)
 
+    def _mine_changes_async(self, repo_names, processed_commits, pool):
+        start = time.time()
+        extract_processes = min(len(repo_names), self.EXTRACT_PROCESSES)
+
+        with multiprocessing.Manager() as manager, \
+                multiprocessing.Pool(processes=extract_processes) as extract_pool:
+            commits_queue = manager.Queue(maxsize=self.PROCESSES * self.POOL_CHUNK_SIZE)
+            extraction = extract_pool.map_async(
+                functools.partial(self._extract_commits_to_queue, commits_queue=commits_queue),
+                repo_names, chunksize=1)
+
+            progress = RepoProgress()
+            remaining_parts = {}
+            commit_to_filenames = {}
+            failed_commits = set()
+            try:
+                for repo_name, commit_hash, parts, filenames in pool.imap_unordered(
+                        self._try_build_and_store_change_graphs,
+                        self._iter_extracted_commits(commits_queue, repo_names, extraction, progress),
+                        chunksize=self.POOL_CHUNK_SIZE):
+                    key = (repo_name, commit_hash)
+                    is_stored = filenames is not None
+                    if is_stored:
+                        commit_to_filenames.setdefault(key, []).extend(filenames)
+                    else:
+                        failed_commits.add(key)
+
+                    # graphs of a split commit are published once all of its parts are stored,
+                    # so a failed commit is retried later without duplicating the graphs of other parts
+                    remaining = remaining_parts.pop(key, parts) - 1
+                    if remaining:
+                        remaining_parts[key] = remaining
+                    elif key in failed_commits:
+                        failed_commits.remove(key)
+                        self._remove_change_graphs(commit_to_filenames.pop(key, []))
+                    else:
+                        self._publish_change_graphs(commit_to_filenames.pop(key, []))
+                        processed_commits.add(repo_name, commit_hash)
+
+                    progress.finish_task(repo_name, is_stored)
+                    self._mark_visited(progress.pop_finished(), processed_commits)
+            except:
+                logger.error('Pool.imap_unordered failed', exc_info=True)
+
+            self._mark_visited(progress.pop_finished(), processed_commits)
+
+        logger.warning(f'Done building change graphs for {len(repo_names)} repositories', start_time=start)
+
+    def _extract_commits_to_queue(self, repo_name, commits_queue):
+        commits_queue.put((repo_name, self.ExtractionMessage.STARTED, os.getpid()))
+
+        is_extracted = False
+        try:
+            for commit in self._extract_commits(repo_name):
+                commits_queue.put((repo_name, self.ExtractionMessage.COMMIT, commit))
+            is_extracted = True
+        except:
+            logger.error(f'Unable to extract commits for repo={repo_name}', exc_info=True, show_pid=True)
+        finally:
+            commits_queue.put((repo_name, self.ExtractionMessage.DONE, is_extracted))
+
+    def _mark_visited(self, repo_names, processed_commits):
+        if not repo_names:
+            return
+
+        processed_commits.flush()
+        self._data['visited'].extend(repo_names)
+        self._save_data_file()
+
+    def _iter_extracted_commits(self, commits_queue, repo_names, extraction, progress):
+        repo_to_pid = {}  # repositories being extracted right now
+        done_cnt = 0
+        while done_cnt < len(repo_names):
+            try:
+                repo_name, message, payload = commits_queue.get(timeout=self.EXTRACT_QUEUE_TIMEOUT)
+            except queue.Empty:
+                # an extraction process killed by the system never reports its repository as done
+                lost_repo_names = [name for name, pid in repo_to_pid.items() if not self._is_process_alive(pid)]
+                for lost_repo_name in lost_repo_names:
+                    del repo_to_pid[lost_repo_name]
+                    done_cnt += 1
+                    logger.error(f'Extraction process of repo={lost_repo_name} has died')
+
+                if extraction.ready() or not repo_to_pid and not lost_repo_names:
+                    logger.error(f'Extraction has stopped, {len(repo_names) - done_cnt} repositories were lost')
+                    return
+                continue
+
+            if message == self.ExtractionMessage.COMMIT:
+                for part in self._split_commit(payload):
+                    progress.add_task(repo_name)
+                    yield part
+            elif message == self.ExtractionMessage.STARTED:
+                repo_to_pid[repo_name] = payload
+            else:
+                repo_to_pid.pop(repo_name, None)
+                done_cnt += 1
+                progress.finish_extraction(repo_name, payload)
+                logger.warning(f'Done extracting commits for repo={repo_name} [{done_cnt}/{len(repo_names)}]')
+
+    @staticmethod
+    def _is_process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+    @staticmethod
+    def _split_commit(commit):
+        modifications = commit['modifications']
+        if len(modifications) <= GitAnalyzer.MAX_TASK_MODIFICATIONS:
+            yield commit
+            return
+
+        parts = range(0, len(modifications), GitAnalyzer.MAX_TASK_MODIFICATIONS)
+        for i in parts:
+            part = dict(commit)
+            part['modifications'] = modifications[i:i + GitAnalyzer.MAX_TASK_MODIFICATIONS]
+            part['parts'] = len(parts)
+            yield part
+
     def _extract_commits(self, repo_name):
         start = time.time()
 
         repo_path = os.path.join(self.GIT_REPOSITORIES_DIR, repo_name)
         repo_url = self._get_repo_url(repo_path)
-        repo = RepositoryMining(repo_path, only_no_merge=True)
+        repo = pygit2.Repository(repo_path)
+        if repo.head_is_unborn:
+            return
+
+        with storage.ProcessedCommits(self.PROCESSED_COMMITS_DB_PATH) as processed_commits:
+            yield from self._extract_new_commits(repo, repo_name, repo_path, repo_url, processed_commits)
 
-        commits = []
-        for commit in repo.traverse_commits():
-            if not commit.parents:
+        logger.log(logger.WARNING, 'Commits extracted', start_time=start)
+
+    def _extract_new_commits(self, repo, repo_name, repo_path, repo_url, processed_commits):
+        processed_hashes = processed_commits.get_hashes(repo_name)
+        for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_REVERSE):
+            if len(commit.parents) != 1:  # initial and merge commits
                 continue
 
-            if self.MIN_DATE and commit.committer_date < self.MIN_DATE:
+            if str(commit.id) in processed_hashes:
+                continue
+
+            commit_dtm = datetime.datetime.fromtimestamp(
+                commit.commit_time, tz=datetime.timezone(datetime.timedelta(minutes=commit.commit_time_offset)))
+            if self.MIN_DATE and commit_dtm < self.MIN_DATE:
                 continue
 
             cut = {
@@ -111,10 +289,9 @@ class GitAnalyzer:
                     'email': commit.author.email,
                     'name': commit.author.name
                 } if commit.author else None,
-                'num': len(commits)+1,
-                'hash': commit.hash,
-                'dtm': commit.committer_date,
-                'msg': commit.msg,
+                'hash': str(commit.id),
+                'dtm': commit_dtm,
+                'msg': commit.message.strip(),
                 'modifications': [],
                 'repo': {
                     'name': repo_name,
@@ -123,128 +300,238 @@ class GitAnalyzer:
                 }
             }
 
-            for mod in commit.modifications:
-                cut['modifications'].append({
-                    'type': mod.change_type,
+            diff = commit.parents[0].tree.diff_to_tree(commit.tree)
+            for delta in diff.deltas:
+                # only modified python files are analyzed, their blobs are not read otherwise
+                if delta.status != pygit2.GIT_DELTA_MODIFIED or delta.old_file.id == delta.new_file.id:
+                    continue
 
-                    'old_src': mod.source_code_before,
-                    'old_path': mod.old_path,
+                if not (delta.old_file.path.endswith('.py') and delta.new_file.path.endswith('.py')):
+                    continue
 
-                    'new_src': mod.source_code,
-                    'new_path': mod.new_path
+                # sources are read by the workers from the object database, which is shared through
+                # the page cache, so only blob ids are sent instead of pickling every source twice
+                cut['modifications'].append({
+                    'old_sha': str(delta.old_file.id),
+                    'old_path': delta.old_file.path,
+
+                    'new_sha': str(delta.new_file.id),
+                    'new_path': delta.new_file.path
                 })
 
-            commits.append(cut)
+            if not cut['modifications']:  # nothing to build, so the commit is not diffed again
+                processed_commits.add(repo_name, cut['hash'])
+                continue
+
+            yield cut
 
-        logger.log(logger.WARNING, 'Commits extracted', start_time=start)
-        return commits
+    @staticmethod
+    def _get_repository(repo_path):
+        # commits of several repositories are interleaved, every open repository holds its packfiles open,
+        # so only a few of them are kept per worker
+        repo = GitAnalyzer._repositories.get(repo_path)
+        if repo is not None:
+            GitAnalyzer._repositories.move_to_end(repo_path)
+            return repo
+
+        repo = GitAnalyzer._repositories[repo_path] = pygit2.Repository(repo_path)
+        if len(GitAnalyzer._repositories) > GitAnalyzer.REPOSITORIES_CACHE_SIZE:
+            _, evicted_repo = GitAnalyzer._repositories.popitem(last=False)
+            evicted_repo.free()
+        return repo
+
+    @staticmethod
+    def _read_blob(repo, oid):
+        try:
+            return repo[oid].data.decode('utf-8', 'ignore')
+        except KeyError:  # submodule commits are not stored in the repository
+            logger.info(f'Unable to read git object {oid}', show_pid=True)
+            return None
 
     @staticmethod
     def _get_repo_url(repo_path):
+        config_path = GitAnalyzer._get_git_config_path(repo_path)
+        if config_path:
+            config = configparser.ConfigParser(strict=False, interpolation=None)
+            try:
+                config.read(config_path)
+                url = config.get('remote "origin"', 'url', fallback='').strip()
+
+                # quoting, escapes and inline comments follow git rules, which git itself resolves
+                if not any(c in url for c in '";#\\'):
+                    return url
+            except configparser.Error:
+                logger.info(f'Unable to parse git config {config_path}', exc_info=True)
+
         args = ['git', 'config', '--get', 'remote.origin.url']
         result = subprocess.run(args, stdout=subprocess.PIPE, cwd=repo_path).stdout.decode('utf-8')
         return result.strip()
 
+    @staticmethod
+    def _get_git_config_path(repo_path):
+        git_path = os.path.join(repo_path, '.git')
+
+        if os.path.isfile(git_path):  # worktrees and submodules keep a 'gitdir: <path>' pointer
+            with open(git_path, 'r') as f:
+                pointer = f.readline().strip()
+            if not pointer.startswith('gitdir:'):
+                return None
+
+            git_path = os.path.join(repo_path, pointer[len('gitdir:'):].strip())
+            common_dir_path = os.path.join(git_path, 'commondir')
+            if os.path.isfile(common_dir_path):
+                with open(common_dir_path, 'r') as f:
+                    git_path = os.path.join(git_path, f.readline().strip())
+        elif not os.path.isdir(git_path):  # bare repository
+            git_path = repo_path
+
+        config_path = os.path.join(git_path, 'config')
+        return config_path if os.path.isfile(config_path) else None
+
     @staticmethod
     def _store_change_graphs(graphs):
-        pickled_graphs = []
+        filename = f'{os.getpid()}_{time.time_ns()}_{next(GitAnalyzer._store_counter)}{storage.get_file_extension()}'
+        logger.info(f'Trying to store graphs to {filename}', show_pid=True)
+
+        # graphs stay hidden from the readers of the storage until their commit is processed
+        storage.dump_pickled_graphs(
+            GitAnalyzer._pickle_graphs(graphs),
+            os.path.join(GitAnalyzer.STORAGE_DIR, f'{GitAnalyzer.PENDING_GRAPHS_PREFIX}{filename}'))
+        logger.info(f'Storing graphs to {filename} finished', show_pid=True)
+        return filename
+
+    @staticmethod
+    def _publish_change_graphs(filenames):
+        for filename in filenames:
+            os.replace(os.path.join(GitAnalyzer.STORAGE_DIR, f'{GitAnalyzer.PENDING_GRAPHS_PREFIX}{filename}'),
+                       os.path.join(GitAnalyzer.STORAGE_DIR, filename))
+
+    @staticmethod
+    def _remove_change_graphs(filenames):
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(GitAnalyzer.STORAGE_DIR, f'{GitAnalyzer.PENDING_GRAPHS_PREFIX}{filename}'))
+            except FileNotFoundError:
+                pass
+
+    def _remove_pending_change_graphs(self):
+        # left by commits that were being processed when a previous run was interrupted
+        with os.scandir(self.STORAGE_DIR) as entries:
+            self._remove_change_graphs([
+                entry.name[len(self.PENDING_GRAPHS_PREFIX):] for entry in entries
+                if entry.name.startswith(self.PENDING_GRAPHS_PREFIX)])
+
+    @staticmethod
+    def _pickle_graphs(graphs):
         for graph in graphs:
             try:
-                pickled = pickle.dumps(graph, protocol=5)
-                pickled_graphs.append(pickled)
+                yield pickle.dumps(graph, protocol=5)
             except RecursionError:
                 logger.error(f'Unable to pickle graph, file_path={graph.repo_info.old_method.file_path}, '
                              f'method={graph.repo_info.old_method.full_name}', exc_info=True)
 
-        filename = uuid.uuid4().hex
-        logger.info(f'Trying to store graphs to {filename}', show_pid=True)
-        with open(os.path.join(GitAnalyzer.STORAGE_DIR, f'{filename}.pickle'), 'w+b') as f:
-            pickle.dump(pickled_graphs, f)
-        logger.info(f'Storing graphs to {filename} finished', show_pid=True)
+    @staticmethod
+    def _try_build_and_store_change_graphs(commit):
+        filenames = []
+        try:
+            GitAnalyzer._build_and_store_change_graphs(commit, filenames)
+        except:
+            logger.error(f'Unable to process commit #{commit["hash"]} of repo={commit["repo"]["name"]}',
+                         exc_info=True, show_pid=True)
+            GitAnalyzer._remove_change_graphs(filenames)
+            filenames = None
+
+        # graphs are stored as pending, they are published by the caller once the whole commit is stored
+        return commit['repo']['name'], commit['hash'], commit.get('parts', 1), filenames
 
     @staticmethod
-    def _build_and_store_change_graphs(commit):
+    def _build_and_store_change_graphs(commit, filenames):
         change_graphs = []
         commit_msg = commit['msg'].replace('\n', '; ')
         logger.info(f'Looking at commit #{commit["hash"]}, msg: "{commit_msg}"', show_pid=True)
 
+        repo = GitAnalyzer._get_repository(commit['repo']['path'])
         for mod in commit['modifications']:
-            if mod['type'] != ModificationType.MODIFY:
-                continue
-
-            if not all([mod['old_path'].endswith('.py'), mod['new_path'].endswith('.py')]):
-                continue
-
             old_method_to_new = GitAnalyzer._get_methods_mapping(
-                GitAnalyzer._extract_methods(mod['old_path'], mod['old_src']),
-                GitAnalyzer._extract_methods(mod['new_path'], mod['new_src'])
+                GitAnalyzer._extract_methods(repo, mod['old_path'], mod['old_sha']),
+                GitAnalyzer._extract_methods(repo, mod['new_path'], mod['new_sha'])
             )
 
             for old_method, new_method in old_method_to_new.items():
                 old_method_src = old_method.get_source()
                 new_method_src = new_method.get_source()
 
-                if not all([old_method_src, new_method_src]) or old_method_src.strip() == new_method_src.strip():
+                if not old_method_src or not new_method_src or old_method_src == new_method_src:
                     continue
 
                 line_count = max(old_method_src.count('\n'), new_method_src.count('\n'))
                 if line_count > settings.get('traverse_file_max_line_count'):
-                    logger.info(f'Ignored files due to line limit: {mod["old_path"]} -> {mod["new_src"]}')
+                    logger.info(f'Ignored files due to line limit: {mod["old_path"]} -> {mod["new_path"]}')
                     continue
 
-                with tempfile.NamedTemporaryFile(mode='w+t', suffix='.py') as t1, \
-                        tempfile.NamedTemporaryFile(mode='w+t', suffix='.py') as t2:
-
-                    t1.writelines(old_method_src)
-                    t1.seek(0)
-                    t2.writelines(new_method_src)
-                    t2.seek(0)
-
-                    repo_info = RepoInfo(
-                        commit['repo']['name'],
-                        commit['repo']['path'],
-                        commit['repo']['url'],
-                        commit['hash'],
-                        commit['dtm'],
-                        mod['old_path'],
-                        mod['new_path'],
-                        old_method,
-                        new_method,
-                        author_email=commit['author']['email'] if commit.get('author') else None,
-                        author_name=commit['author']['name'] if commit.get('author') else None
-                    )
-
-                    try:
-                        cg = changegraph.build_from_files(
-                            os.path.realpath(t1.name), os.path.realpath(t2.name), repo_info=repo_info)
-                    except:
-                        logger.log(logger.ERROR,
-                                   f'Unable to build a change graph for '
-                                   f'repo={commit["repo"]["path"]}, '
-                                   f'commit=#{commit["hash"]}, '
-                                   f'method={old_method.full_name}, '
-                                   f'line={old_method.ast.lineno}', exc_info=True, show_pid=True)
-                        continue
-
-                    change_graphs.append(cg)
-
-                    if len(change_graphs) >= GitAnalyzer.STORE_INTERVAL:
-                        GitAnalyzer._store_change_graphs(change_graphs)
-                        change_graphs.clear()
+                repo_info = RepoInfo(
+                    commit['repo']['name'],
+                    commit['repo']['path'],
+                    commit['repo']['url'],
+                    commit['hash'],
+                    commit['dtm'],
+                    mod['old_path'],
+                    mod['new_path'],
+                    old_method,
+                    new_method,
+                    author_email=commit['author']['email'] if commit.get('author') else None,
+                    author_name=commit['author']['name'] if commit.get('author') else None
+                )
+
+                try:
+                    cg = changegraph.build_from_sources(old_method_src, new_method_src, repo_info=repo_info)
+                except:
+                    logger.log(logger.ERROR,
+                               f'Unable to build a change graph for '
+                               f'repo={commit["repo"]["path"]}, '
+                               f'commit=#{commit["hash"]}, '
+                               f'method={old_method.full_name}, '
+                               f'line={old_method.ast.lineno}', exc_info=True, show_pid=True)
+                    continue
+
+                change_graphs.append(cg)
+
+                if len(change_graphs) >= GitAnalyzer.STORE_INTERVAL:
+                    filenames.append(GitAnalyzer._store_change_graphs(change_graphs))
+                    change_graphs.clear()
 
         if change_graphs:
-            GitAnalyzer._store_change_graphs(change_graphs)
+            filenames.append(GitAnalyzer._store_change_graphs(change_graphs))
             change_graphs.clear()
 
     @staticmethod
-    def _extract_methods(file_path, src):
+    def _extract_methods(repo, file_path, sha):
+        # the new version of a file in one commit is usually the old version in the next one,
+        # so parsed methods are cached per worker by the path and the blob id
+        key = (file_path, sha)
+        methods = GitAnalyzer._methods_cache.get(key)
+        if methods is not None:
+            GitAnalyzer._methods_cache.move_to_end(key)
+            return methods
+
+        src = GitAnalyzer._read_blob(repo, sha)
+        if src is None:
+            return ()
+
         try:
             src_ast = ast.parse(src, mode='exec')
         except:
             logger.log(logger.INFO, 'Unable to compile src and extract methods', exc_info=True, show_pid=True)
-            return []
+            methods = ()
+        else:
+            methods = extract_methods(file_path, src, src_ast)
+            GitAnalyzer._set_unique_names(methods)
+            methods = tuple(methods)
 
-        return ASTMethodExtractor(file_path, src).visit(src_ast)
+        GitAnalyzer._methods_cache[key] = methods
+        if len(GitAnalyzer._methods_cache) > GitAnalyzer.METHODS_CACHE_SIZE:
+            GitAnalyzer._methods_cache.popitem(last=False)
+        return methods
 
     @staticmethod
     def _set_unique_names(methods):
@@ -258,66 +545,113 @@ class GitAnalyzer:
 
     @staticmethod
     def _get_methods_mapping(old_methods, new_methods):
-        GitAnalyzer._set_unique_names(old_methods)
-        GitAnalyzer._set_unique_names(new_methods)
-
-        old_method_to_new = {}
-        for old_method in old_methods:
-            for new_method in new_methods:
-                if old_method.full_name == new_method.full_name:
-                    old_method_to_new[old_method] = new_method
-        return old_method_to_new
-
-
-class ASTMethodExtractor(ast.NodeVisitor):
-    def __init__(self, path, src):
-        self.file_path = path
-        self.src = src
-
-    def visit_Module(self, node):
-        methods = []
-        for st in node.body:
-            result = self.visit(st)
-            if result:
-                methods += result
-        return methods
-
-    def visit_ClassDef(self, node):
-        methods = []
-        for st in node.body:
-            result = self.visit(st)
-            if result:
-                methods += result
+        name_to_new_method = {new_method.full_name: new_method for new_method in new_methods}
+        return {old_method: name_to_new_method[old_method.full_name] for old_method in old_methods
+                if old_method.full_name in name_to_new_method}
 
-        for method in methods:
-            method.extend_path(node.name)
 
-        return methods
+class RepoProgress:
+    # tasks are counted by the pool thread that feeds them and by the main thread collecting results,
+    # a repository is finished once it is extracted and all of its tasks are stored without errors
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._repo_to_task_cnt = collections.Counter()
+        self._extracted_repo_names = set()
+        self._failed_repo_names = set()
+
+    def add_task(self, repo_name):
+        with self._lock:
+            self._repo_to_task_cnt[repo_name] += 1
+
+    def finish_task(self, repo_name, is_stored):
+        with self._lock:
+            self._repo_to_task_cnt[repo_name] -= 1
+            if not is_stored:
+                self._failed_repo_names.add(repo_name)
+
+    def finish_extraction(self, repo_name, is_extracted):
+        with self._lock:
+            if is_extracted:
+                self._extracted_repo_names.add(repo_name)
+            else:
+                self._failed_repo_names.add(repo_name)
+
+    def pop_finished(self):
+        with self._lock:
+            finished = [repo_name for repo_name in self._extracted_repo_names
+                        if repo_name not in self._failed_repo_names and not self._repo_to_task_cnt[repo_name]]
+            self._extracted_repo_names.difference_update(finished)
+        return finished
+
+
+def extract_methods(file_path, src, tree):
+    line_offsets = get_line_offsets(src)
+    methods = []
+
+    # a stack of body iterators keeps the methods in the source order without recursion
+    stack = [(iter(tree.body), '')]
+    while stack:
+        body, prefix = stack[-1]
+        for node in body:
+            if isinstance(node, ast.FunctionDef):
+                method = Method(file_path, node.name, node, src, line_offsets=line_offsets)
+                method.full_name = f'{prefix}{node.name}'
+                methods.append(method)
+            elif isinstance(node, ast.ClassDef):
+                stack.append((iter(node.body), f'{prefix}{node.name}.'))
+                break
+        else:
+            stack.pop()
 
-    def visit_FunctionDef(self, node):
-        return [Method(self.file_path, node.name, node, self.src)]
+    return methods
 
 
 class Method:
-    def __init__(self, path, name, ast, src):
+    def __init__(self, path, name, ast, src, line_offsets=None):
         self.file_path = path
         self.ast = ast
-        self.src = src.strip()
+        self.src = src
+        self._line_offsets = line_offsets  # shared by all methods of a file, see get_line_offsets
 
         self.name = name
         self.full_name = name
 
-    def extend_path(self, prefix, separator='.'):
-        self.full_name = f'{prefix}{separator}{self.full_name}'
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_line_offsets'] = None
+        return state
 
-    # TODO:  last = lines[end_lineno].encode()[:end_col_offset].decode(), IndexError: list index out of range
     def get_source(self):
         try:
-            return ast.get_source_segment(self.src, self.ast)
+            if getattr(self, '_line_offsets', None) is None:
+                self._line_offsets = get_line_offsets(self.src)
+
+            start = self._get_offset(self.ast.lineno, self.ast.col_offset)
+            end = self._get_offset(self.ast.end_lineno, self.ast.end_col_offset)
+            return self.src[start:end]
         except:
             logger.info(f'Unable to extract source segment from {self.ast}', show_pid=True)
             return None
 
+    def _get_offset(self, lineno, col_offset):
+        line_start = self._line_offsets[lineno - 1]
+
+        # ast column offsets are counted in utf-8 bytes, there are at least as many of them as characters
+        prefix = self.src[line_start:line_start + col_offset]
+        if not prefix.isascii():
+            prefix = prefix.encode('utf-8')[:col_offset].decode('utf-8', 'ignore')
+
+        return line_start + len(prefix)
+
+
+_LINE_END_RE = re.compile(r'\r\n|\r|\n')
+
+
+def get_line_offsets(src):
+    offsets = [0]
+    offsets.extend(match.end() for match in _LINE_END_RE.finditer(src))
+    return offsets
+
 
 class RepoInfo:
     def __init__(self, repo_name, repo_path, repo_url, commit_hash, commit_dtm,